@@ -1,59 +1,196 @@
+import os
+import tempfile
 import streamlit as st
 import yfinance as yf
+import requests_cache
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 # === 页面配置 ===
 st.set_page_config(page_title="全球资产看板", layout="wide", page_icon="🌏")
 
+# 持仓以 Parquet 落盘，服务重启后仍可恢复
+# 路径固定在脚本所在目录，不随启动目录变化
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+PORTFOLIO_DIR = os.path.join(APP_DIR, ".portfolio")
+MARKETS = ('cn', 'sg', 'us')
+
+def portfolio_path(market):
+    return os.path.join(PORTFOLIO_DIR, f"{market}.parquet")
+
 # === 🛠️ 紧急修复工具：重置按钮 ===
 st.sidebar.header("⚙️ 设置")
 if st.sidebar.button("🗑️ 重置所有数据 (修复卡顿)", help="如果你发现页面白屏或卡住，请点此按钮"):
     for key in list(st.session_state.keys()):
         del st.session_state[key]
+    for market in MARKETS:
+        try:
+            os.remove(portfolio_path(market))
+        except OSError:
+            pass
     st.rerun()
 
 # === 1. 初始化基础数据 ===
+# 列类型统一登记：代码/名称为字符串，用户录入的数值保持 64 位，买卖信号与盈亏按录入值精确比较
+# 现价同样保持 64 位 (汇总与成本直接相减)，其余仅用于展示的计算结果用 32 位类型，内存减半
+# 编辑器回写的表也按此校正，避免数值列退化为 object
+COLUMN_DTYPES = {
+    'code': 'string', 'name': 'string',
+    'cost': 'float64', 'qty': 'int64', 'exp_div': 'float64', 'buy_yld': 'float64', 'sell_yld': 'float64',
+    'price': 'float64', 'change_pct': 'float32', 'change_amt': 'float32', 'mkt_val_local': 'float32',
+    'mkt_val_cny': 'float32', 'profit_cny': 'float32', 'yield_now': 'float32', 'total_return_pct': 'float32',
+}
+
+def narrow_dtypes(df):
+    df = df.assign(qty=df['qty'].fillna(0)) if 'qty' in df.columns else df
+    return df.astype({col: t for col, t in COLUMN_DTYPES.items() if col in df.columns})
+
 if 'portfolio_setup_v2' not in st.session_state:
-    # 定义基础列
-    base_cols_cn = ["code", "name", "cost", "qty", "exp_div", "buy_yld", "sell_yld"]
-    base_cols_us = ["code", "name", "cost", "qty"]
+    # 初始化默认数据 (按列构造，直接给定 dtype，省去逐行推断)
+    st.session_state.cn_inputs = pd.DataFrame({
+        "code":     pd.array(["601919.SS", "600900.SS", "0941.HK"], dtype='string'),
+        "name":     pd.array(["中远海控", "长江电力", "中国移动HK"], dtype='string'),
+        "cost":     np.array([10.0, 22.0, 65.0], dtype='float64'),
+        "qty":      np.array([1000, 500, 500], dtype='int64'),
+        "exp_div":  np.array([1.5, 0.9, 4.8], dtype='float64'),
+        "buy_yld":  np.array([12.0, 4.0, 7.0], dtype='float64'),
+        "sell_yld": np.array([5.0, 2.0, 3.0], dtype='float64'),
+    })
     
-    # 初始化默认数据
-    st.session_state.cn_inputs = pd.DataFrame([
-        {"code": "601919.SS", "name": "中远海控", "cost": 10.0, "qty": 1000, "exp_div": 1.5, "buy_yld": 12.0, "sell_yld": 5.0},
-        {"code": "600900.SS", "name": "长江电力", "cost": 22.0, "qty": 500, "exp_div": 0.9, "buy_yld": 4.0, "sell_yld": 2.0},
-        {"code": "0941.HK",    "name": "中国移动HK", "cost": 65.0, "qty": 500, "exp_div": 4.8, "buy_yld": 7.0, "sell_yld": 3.0},
-    ], columns=base_cols_cn)
+    st.session_state.sg_inputs = pd.DataFrame({
+        "code":     pd.array(["C38U.SI", "M44U.SI"], dtype='string'),
+        "name":     pd.array(["CapLand IntCom", "Mapletree Log"], dtype='string'),
+        "cost":     np.array([1.90, 1.50], dtype='float64'),
+        "qty":      np.array([2000, 3000], dtype='int64'),
+        "exp_div":  np.array([0.10, 0.08], dtype='float64'),
+        "buy_yld":  np.array([6.0, 6.5], dtype='float64'),
+        "sell_yld": np.array([4.0, 4.5], dtype='float64'),
+    })
+
+    st.session_state.us_inputs = pd.DataFrame({
+        "code": pd.array(["VOO", "NVDA", "AAPL"], dtype='string'),
+        "name": pd.array(["标普500 ETF", "英伟达", "苹果"], dtype='string'),
+        "cost": np.array([400.0, 450.0, 170.0], dtype='float64'),
+        "qty":  np.array([10, 5, 10], dtype='int64'),
+    })
     
-    st.session_state.sg_inputs = pd.DataFrame([
-        {"code": "C38U.SI", "name": "CapLand IntCom", "cost": 1.90, "qty": 2000, "exp_div": 0.10, "buy_yld": 6.0, "sell_yld": 4.0},
-        {"code": "M44U.SI", "name": "Mapletree Log",  "cost": 1.50, "qty": 3000, "exp_div": 0.08, "buy_yld": 6.5, "sell_yld": 4.5},
-    ], columns=base_cols_cn)
-
-    st.session_state.us_inputs = pd.DataFrame([
-        {"code": "VOO",  "name": "标普500 ETF", "cost": 400.0, "qty": 10},
-        {"code": "NVDA", "name": "英伟达",       "cost": 450.0, "qty": 5},
-        {"code": "AAPL", "name": "苹果",         "cost": 170.0, "qty": 10},
-    ], columns=base_cols_us)
+    # 有保存过的持仓则优先读取 (读回后按登记类型校正，兼容旧文件)
+    # 文件缺失或损坏时保留默认持仓，不让坏文件拖垮每个新会话
+    for market in MARKETS:
+        try:
+            st.session_state[f"{market}_inputs"] = narrow_dtypes(pd.read_parquet(portfolio_path(market)))
+        except Exception:
+            pass
     
     st.session_state.portfolio_setup_v2 = True
 
 # === 2. 侧边栏：资产录入与汇率 ===
 st.sidebar.header("💰 现金与固收")
 
-@st.cache_data(ttl=3600)
-def get_exchange_rates():
+QUOTE_TTL = 60 # 行情最长陈旧秒数
+# 磁盘缓存的响应还会被内存缓存再保留一轮，两段有效期之和不超过 QUOTE_TTL
+HTTP_CACHE_TTL = 20
+
+@st.cache_resource
+def http_session():
+    # 全局复用的连接池，避免每次请求重新握手 TCP/TLS
+    # 响应同时落盘到 SQLite，新进程冷启动也能直接命中缓存
+    s = requests_cache.CachedSession(os.path.join(APP_DIR, '.yf_cache'), backend='sqlite', expire_after=HTTP_CACHE_TTL)
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry)
+    s.mount('https://', adapter)
+    s.headers['User-Agent'] = 'Mozilla/5.0'
+    return s
+
+QUOTE_URL = "https://query1.finance.yahoo.com/v7/finance/spark"
+QUOTE_BATCH = 20 # Yahoo 单个 URL 最多约 20 个代码
+QUOTE_COLS = ['price', 'prev_close']
+FX_SYMBOLS = ('CNY=X', 'SGDCNY=X')
+
+def _request_quotes(session, symbols):
+    params = {'symbols': ",".join(symbols), 'range': '2d', 'interval': '1d'}
+    resp = session.get(QUOTE_URL, params=params, timeout=5)
+    resp.raise_for_status()
+    return orjson.loads(resp.content)['spark']['result']
+
+def _last_two_closes(result):
+    # spark 每个代码返回近两日日线收盘价，最后一根即现价，未收盘/停牌的值为 null
+    # 无效代码没有 indicators，按缺失处理，不让单个代码拖垮整批
+    chart = (result.get('response') or [{}])[0]
+    quote = (chart.get('indicators', {}).get('quote') or [{}])[0]
+    closes = [c for c in quote.get('close') or [] if c is not None]
+    price = closes[-1] if closes else 0.0
+    prev = closes[-2] if len(closes) > 1 else 0.0
+    return price, prev
+
+def _download_quotes(symbols):
+    # 备用路径：直连接口不可用时退回 yfinance 批量下载 (yfinance 自行管理会话)
     try:
-        tickers = yf.Tickers("CNY=X SGDCNY=X")
-        usd_cny = tickers.tickers['CNY=X'].fast_info['last_price']
-        sgd_cny = tickers.tickers['SGDCNY=X'].fast_info['last_price']
-        return usd_cny, sgd_cny
-    except:
-        return 7.2, 5.3
-
-usd_rate, sgd_rate = get_exchange_rates()
+        hist = yf.download(list(symbols), period='2d', interval='1d', group_by='ticker', threads=True, progress=False, auto_adjust=False)
+        if isinstance(hist.columns, pd.MultiIndex):
+            closes = hist.xs('Close', level=1, axis=1)
+        else:
+            closes = hist[['Close']].set_axis(list(symbols)[:1], axis=1)
+    except Exception:
+        return pd.DataFrame(columns=QUOTE_COLS, dtype=float)
+    
+    closes = closes.ffill()
+    if closes.empty: return pd.DataFrame(columns=QUOTE_COLS, dtype=float)
+    last = closes.iloc[-1]
+    prev = closes.iloc[-2] if len(closes) > 1 else last
+    return pd.DataFrame({'price': last, 'prev_close': prev})
+
+@st.cache_data(ttl=QUOTE_TTL - HTTP_CACHE_TTL, show_spinner=False)
+def _fetch_quotes(tickers):
+    # 返回以代码为索引、含 price / prev_close 两列的行情表
+    # 只缓存网络请求，成本/持仓的修改仍然基于缓存价格即时重算
+    chunks = [tickers[i:i + QUOTE_BATCH] for i in range(0, len(tickers), QUOTE_BATCH)]
+    try:
+        # 会话在主线程取出再交给工作线程，线程里没有 ScriptRunContext，不直接碰 st 缓存
+        session = http_session()
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            results = [r for part in ex.map(partial(_request_quotes, session), chunks) for r in part]
+        
+        # 结果数组预先分配，按下标填充
+        n = len(results)
+        symbols = np.empty(n, dtype=object)
+        prices = np.zeros(n, dtype='float64')
+        prevs = np.zeros(n, dtype='float64')
+        for i, r in enumerate(results):
+            symbols[i] = r['symbol']
+            prices[i], prevs[i] = _last_two_closes(r)
+    except Exception:
+        # 直连接口请求或解析失败时退回 yfinance
+        return _download_quotes(tickers)
+    
+    return pd.DataFrame({'price': prices, 'prev_close': prevs}, index=symbols)
+
+def load_quotes():
+    # 三个市场的股票代码与汇率合并为一次批量请求
+    symbols = set(FX_SYMBOLS)
+    for key in ('cn_inputs', 'sg_inputs', 'us_inputs'):
+        codes = st.session_state[key]['code']
+        symbols.update(codes[codes.notna() & (codes != "")])
+    try:
+        return _fetch_quotes(tuple(sorted(symbols)))
+    except Exception:
+        return pd.DataFrame(columns=QUOTE_COLS, dtype=float)
+
+def get_exchange_rates(quotes):
+    usd_cny, sgd_cny = quotes['price'].reindex(list(FX_SYMBOLS)).to_numpy(dtype=float)
+    return (usd_cny if usd_cny > 0 else 7.2), (sgd_cny if sgd_cny > 0 else 5.3)
+
+with st.spinner('正在同步全球数据...'):
+    quotes = load_quotes()
+usd_rate, sgd_rate = get_exchange_rates(quotes)
 st.sidebar.caption(f"参考汇率: USD/CNY ≈ {usd_rate:.2f} | SGD/CNY ≈ {sgd_rate:.2f}")
 
 with st.sidebar.form("cash_bond_form"):
@@ -64,96 +201,176 @@ with st.sidebar.form("cash_bond_form"):
     st.form_submit_button("更新资产状态")
 
 # === 3. 核心逻辑：计算函数 (增强版) ===
-def calculate_market_data(input_df, currency_rate=1.0, mode='yield'):
-    df = input_df.copy()
+# 信号以 int8 存储 (0=持有 1=买入 2=卖出 3=无报价)，仅在展示时映射为文字
+SIGNAL_LABELS = np.array(["⚪ 持有", "🟢 买入", "🔴 卖出", "❌"])
+SIGNAL_STYLES = np.array(['', 'color: green; font-weight: bold', 'color: red; font-weight: bold', ''])
+
+def calculate_market_data(input_df, quotes, currency_rate=1.0, mode='yield'):
+    # 清理空行：按掩码直接取各列底层数组，结果表最后一次性构造，不做整表 copy
+    keep = (input_df['code'].notna() & (input_df['code'] != "")).to_numpy(dtype=bool)
+    base = {col: input_df[col].array[keep] for col in input_df.columns}
+    num = lambda col: np.asarray(base[col], dtype=float)
     
     # 预定义所有需要的列，防止因空数据导致 Key Error
     required_cols = ['price', 'change_pct', 'change_amt', 'mkt_val_local', 'mkt_val_cny', 'profit_cny', 'yield_now', 'action', 'total_return_pct']
-    for col in required_cols:
-        if col not in df.columns:
-            df[col] = 0.0
-    
-    # 清理空行
-    df = df[df['code'].notna() & (df['code'] != "")]
-    if df.empty: return df
+    n = int(keep.sum())
+    cols = {col: np.zeros(n) for col in required_cols}
+    cols['signal'] = np.zeros(n, dtype='int8')
+    if n == 0: return narrow_dtypes(pd.DataFrame({**base, **cols}))
 
-    tickers = " ".join(df['code'].tolist())
+    # 缺失代码价格记为 0
+    codes = pd.Index(base['code'])
+    price = quotes['price'].reindex(codes).fillna(0.0).to_numpy(dtype=float)
+    prev = quotes['prev_close'].reindex(codes).fillna(0.0).to_numpy(dtype=float)
+    cost = num('cost')
+    qty = num('qty')
     
-    try:
-        data = yf.Tickers(tickers)
-    except Exception:
-        return df # 保持默认值返回
-
-    current_prices = []
-    day_changes = []
-    day_changes_pct = []
-
-    for code in df['code']:
-        try:
-            info = data.tickers[code].fast_info
-            price = info['last_price']
-            prev = info['previous_close']
-            
-            if price is None: price = 0.0
-            if prev is None: prev = 0.0
-            
-            current_prices.append(price)
-            change = price - prev if prev else 0
-            pct = (change / prev * 100) if prev > 0 else 0
-            
-            day_changes.append(change)
-            day_changes_pct.append(pct)
-        except:
-            current_prices.append(0.0)
-            day_changes.append(0.0)
-            day_changes_pct.append(0.0)
-
-    df['price'] = current_prices
-    df['change_pct'] = day_changes_pct
-    df['change_amt'] = day_changes
+    # 涨跌整列计算，没有昨收的记为 0
+    has_prev = prev > 0
+    change = np.where(has_prev, price - prev, 0.0)
+    cols['price'] = price
+    cols['change_amt'] = change
+    cols['change_pct'] = np.divide(change, prev, out=np.zeros_like(change), where=has_prev) * 100
     
     # 价值计算
-    df['mkt_val_local'] = df['price'] * df['qty']
-    df['mkt_val_cny'] = df['mkt_val_local'] * currency_rate
-    df['profit_cny'] = (df['price'] - df['cost']) * df['qty'] * currency_rate
+    cols['mkt_val_local'] = price * qty
+    cols['mkt_val_cny'] = cols['mkt_val_local'] * currency_rate
+    cols['profit_cny'] = (price - cost) * qty * currency_rate
     
-    # 策略逻辑
+    # 策略逻辑 (向量化，避免逐行 apply)
     if mode == 'yield':
-        df['yield_now'] = df.apply(lambda x: (x['exp_div'] / x['price'] * 100) if x['price'] > 0 else 0, axis=1)
-        def get_signal(row):
-            if row['price'] <= 0: return "❌"
-            if row['yield_now'] >= row['buy_yld']: return "🟢 买入"
-            elif row['yield_now'] <= row['sell_yld']: return "🔴 卖出"
-            else: return "⚪ 持有"
-        df['action'] = df.apply(get_signal, axis=1)
+        safe_price = np.where(price > 0, price, 1.0)
+        yld = np.where(price > 0, num('exp_div') / safe_price * 100, 0.0)
+        signal = np.select(
+            [price <= 0, yld >= num('buy_yld'), yld <= num('sell_yld')],
+            [3, 1, 2], default=0
+        ).astype('int8')
+        cols['yield_now'] = yld
+        cols['signal'] = signal
+        cols['action'] = SIGNAL_LABELS[signal]
     
     elif mode == 'growth':
-        df['total_return_pct'] = df.apply(lambda x: ((x['price'] - x['cost']) / x['cost'] * 100) if x['cost'] > 0 else 0, axis=1)
-        
-    return df
+        safe_cost = np.where(cost > 0, cost, 1.0)
+        cols['total_return_pct'] = np.where(cost > 0, (price - cost) / safe_cost * 100, 0.0)
+    
+    return narrow_dtypes(pd.DataFrame({**base, **cols}))
+
+MarketTotals = namedtuple('MarketTotals', ['mkt_val', 'cost', 'profit', 'day_gain'])
+
+def summarize_market(calc_df, currency_rate=1.0):
+    # 一次取出价格/成本/数量数组，市值、成本、盈亏、当日波动 (CNY) 共用
+    price = calc_df['price'].to_numpy(dtype=float)
+    cost = calc_df['cost'].to_numpy(dtype=float)
+    qty = calc_df['qty'].to_numpy(dtype=float)
+    change = calc_df['change_amt'].to_numpy(dtype=float)
+    return MarketTotals(
+        mkt_val=float(np.nansum(price * qty)) * currency_rate,
+        cost=float(np.nansum(cost * qty)) * currency_rate,
+        profit=float(np.nansum((price - cost) * qty)) * currency_rate,
+        day_gain=float(np.nansum(change * qty)) * currency_rate,
+    )
 
 # === 4. 主界面构建 (带错误捕获) ===
+# 表格列与格式为常量，避免每次重跑重建
+# 数字格式交给 column_config 在前端渲染，后端 Styler 只负责着色
+# 金额列需要千分位，printf 格式不支持分组，这几列仍由 Styler.format 输出
+YIELD_COLS = ['name', 'price', 'change_pct', 'yield_now', 'action', 'qty', 'mkt_val_local', 'profit_cny']
+GROWTH_COLS = ['name', 'price', 'change_pct', 'total_return_pct', 'qty', 'mkt_val_local', 'profit_cny']
+
+def number_columns(fmt):
+    return {col: st.column_config.NumberColumn(format=f) for col, f in fmt.items()}
+
+FMT_CN = number_columns({'price': '¥%.2f', 'change_pct': '%+.2f%%', 'yield_now': '%.2f%%'})
+FMT_SG = number_columns({'price': 'S$%.3f', 'change_pct': '%+.2f%%', 'yield_now': '%.2f%%'})
+FMT_US = number_columns({'price': '$%.2f', 'change_pct': '%+.2f%%', 'total_return_pct': '%+.2f%%'})
+
+MONEY_CN = {'mkt_val_local': '¥{:,.0f}', 'profit_cny': '¥{:+,.0f}'}
+MONEY_SG = {'mkt_val_local': 'S${:,.0f}', 'profit_cny': '¥{:+,.0f}'}
+MONEY_US = {'mkt_val_local': '${:,.0f}', 'profit_cny': '¥{:+,.0f}'}
+
+def color_return(col):
+    # 整列比较生成样式，按展示精度 (两位小数) 判断，显示为 0.00% 的收益不着色
+    v = np.round(col.to_numpy(dtype=float), 2)
+    return np.where(v > 0, 'color: green', np.where(v < 0, 'color: red', ''))
+
+# 图表按输入数值缓存，数值不变时直接复用 Figure
+# 键随行情与现金输入变化，限制条目数，避免缓存随进程无限增长
+@st.cache_data(max_entries=8)
+def build_pie(values, names):
+    return px.pie(values=list(values), names=list(names), title="资产配置 (CNY)")
+
+@st.cache_data(max_entries=8)
+def build_bar(costs, vals):
+    fig = go.Figure(data=[
+        go.Bar(name='投入成本', x=['CN/HK', 'SG', 'US'], y=list(costs)),
+        go.Bar(name='当前市值', x=['CN/HK', 'SG', 'US'], y=list(vals))
+    ])
+    fig.update_layout(barmode='group', title="盈亏对比 (CNY)")
+    return fig
+
+def save_portfolio(market, df):
+    # 先写临时文件再原子替换，其他会话不会读到写了一半的文件
+    tmp = None
+    try:
+        os.makedirs(PORTFOLIO_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=PORTFOLIO_DIR, suffix='.tmp')
+        os.close(fd)
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, portfolio_path(market))
+    except OSError:
+        pass # 只读环境下仅保留会话内数据
+    finally:
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+def render_stock_tab(key_suffix, calc_df, display_cols, column_fmt, money_fmt):
+    # 直接复用主流程算好的结果表，页签内不再重算
+    input_key = f"{key_suffix}_inputs"
+    with st.expander("✏️ 编辑持仓 (修改后点击应用)", expanded=False):
+        with st.form(f"form_{key_suffix}"):
+            edited = st.data_editor(st.session_state[input_key], num_rows="dynamic", use_container_width=True, key=f"editor_{key_suffix}")
+            submitted = st.form_submit_button("应用修改")
+
+    # 编辑在表单内累积，点击应用后才回写、落盘，并整页刷新让顶部指标同步
+    if submitted:
+        edited = narrow_dtypes(edited)
+        st.session_state[input_key] = edited
+        save_portfolio(key_suffix, edited)
+        st.rerun()
+
+    # 样式按 signal 整列映射，不再逐格扫描文字
+    styler = calc_df[display_cols].style.format(money_fmt)
+    if 'action' in display_cols:
+        styles = SIGNAL_STYLES[calc_df['signal'].to_numpy()]
+        styler = styler.apply(lambda col: styles, subset=['action'])
+    if 'total_return_pct' in display_cols:
+        styler = styler.apply(color_return, subset=['total_return_pct'])
+    st.dataframe(styler, column_config=column_fmt, use_container_width=True, hide_index=True, height=400)
+
 st.title("🌏 个人全球资产概览")
-st.caption("本位币: CNY (人民币) | 编辑表格后按回车自动计算")
+st.caption("本位币: CNY (人民币) | 编辑持仓后点击「应用修改」重新计算")
 
 try:
-    # 获取计算结果
-    with st.spinner('正在同步全球数据...'):
-        df_cn_calc = calculate_market_data(st.session_state.cn_inputs, 1.0, mode='yield')
-        df_sg_calc = calculate_market_data(st.session_state.sg_inputs, sgd_rate, mode='yield')
-        df_us_calc = calculate_market_data(st.session_state.us_inputs, usd_rate, mode='growth')
+    # 获取计算结果 (行情已批量取回，这里只做本地计算，汇总与页签共用)
+    df_cn_calc = calculate_market_data(st.session_state.cn_inputs, quotes, 1.0, mode='yield')
+    df_sg_calc = calculate_market_data(st.session_state.sg_inputs, quotes, sgd_rate, mode='yield')
+    df_us_calc = calculate_market_data(st.session_state.us_inputs, quotes, usd_rate, mode='growth')
+
+    # 各市场汇总只算一次，顶部指标与统计图共用
+    cn_tot = summarize_market(df_cn_calc, 1.0)
+    sg_tot = summarize_market(df_sg_calc, sgd_rate)
+    us_tot = summarize_market(df_us_calc, usd_rate)
+    market_totals = (cn_tot, sg_tot, us_tot)
 
     # 总资产计算
-    total_stock_cny = df_cn_calc['mkt_val_cny'].sum() + df_sg_calc['mkt_val_cny'].sum() + df_us_calc['mkt_val_cny'].sum()
+    total_stock_cny = sum(t.mkt_val for t in market_totals)
     total_cash_cny = cash_cny + (cash_sgd * sgd_rate) + (cash_usd * usd_rate)
     total_bond_cny = bond_usd_val * usd_rate
     net_worth = total_stock_cny + total_cash_cny + total_bond_cny
 
     # 盈亏计算
-    total_profit = df_cn_calc['profit_cny'].sum() + df_sg_calc['profit_cny'].sum() + df_us_calc['profit_cny'].sum()
-    total_day_gain = (df_cn_calc['change_amt'] * df_cn_calc['qty']).sum() + \
-                     (df_sg_calc['change_amt'] * df_sg_calc['qty'] * sgd_rate).sum() + \
-                     (df_us_calc['change_amt'] * df_us_calc['qty'] * usd_rate).sum()
+    total_profit = sum(t.profit for t in market_totals)
+    total_day_gain = sum(t.day_gain for t in market_totals)
 
     # 顶部核心指标
     c1, c2, c3 = st.columns(3)
@@ -173,75 +390,30 @@ try:
         
         with col_a:
             assets = {
-                'A股/港股': df_cn_calc['mkt_val_cny'].sum(),
-                '新加坡REITs': df_sg_calc['mkt_val_cny'].sum(),
-                '美股/ETF': df_us_calc['mkt_val_cny'].sum(),
+                'A股/港股': cn_tot.mkt_val,
+                '新加坡REITs': sg_tot.mkt_val,
+                '美股/ETF': us_tot.mkt_val,
                 '美债': total_bond_cny,
                 '现金': total_cash_cny
             }
-            fig_pie = px.pie(values=list(assets.values()), names=list(assets.keys()), title="资产配置 (CNY)")
+            fig_pie = build_pie(tuple(assets.values()), tuple(assets.keys()))
             st.plotly_chart(fig_pie, use_container_width=True)
             
         with col_b:
-            cost_cn = (st.session_state.cn_inputs['cost'] * st.session_state.cn_inputs['qty']).sum()
-            cost_sg = (st.session_state.sg_inputs['cost'] * st.session_state.sg_inputs['qty'] * sgd_rate).sum()
-            cost_us = (st.session_state.us_inputs['cost'] * st.session_state.us_inputs['qty'] * usd_rate).sum()
-            
-            val_cn = df_cn_calc['mkt_val_cny'].sum()
-            val_sg = df_sg_calc['mkt_val_cny'].sum()
-            val_us = df_us_calc['mkt_val_cny'].sum()
-
-            fig_bar = go.Figure(data=[
-                go.Bar(name='投入成本', x=['CN/HK', 'SG', 'US'], y=[cost_cn, cost_sg, cost_us]),
-                go.Bar(name='当前市值', x=['CN/HK', 'SG', 'US'], y=[val_cn, val_sg, val_us])
-            ])
-            fig_bar.update_layout(barmode='group', title="盈亏对比 (CNY)")
+            fig_bar = build_bar(tuple(t.cost for t in market_totals), tuple(t.mkt_val for t in market_totals))
             st.plotly_chart(fig_bar, use_container_width=True)
 
-    # 辅助函数
-    def render_stock_tab(key_suffix, input_df, calc_df, display_cols, currency_fmt):
-        with st.expander("✏️ 编辑持仓 (修改后按Enter)", expanded=False):
-            edited = st.data_editor(input_df, num_rows="dynamic", use_container_width=True, key=f"editor_{key_suffix}")
-            if key_suffix == 'cn': st.session_state.cn_inputs = edited
-            elif key_suffix == 'sg': st.session_state.sg_inputs = edited
-            elif key_suffix == 'us': st.session_state.us_inputs = edited
-
-        st.dataframe(
-            calc_df[display_cols].style.format(currency_fmt).applymap(
-                lambda v: 'color: green; font-weight: bold' if isinstance(v, str) and '买入' in v 
-                else ('color: red; font-weight: bold' if isinstance(v, str) and '卖出' in v else ''), 
-                subset=['action'] if 'action' in display_cols else None
-            ),
-            use_container_width=True, hide_index=True, height=400
-        )
-
     # Tab 2: CN
     with tab2:
-        render_stock_tab('cn', st.session_state.cn_inputs, df_cn_calc, 
-            ['name', 'price', 'change_pct', 'yield_now', 'action', 'qty', 'mkt_val_local', 'profit_cny'],
-            {'price': '¥{:.2f}', 'change_pct': '{:+.2f}%', 'yield_now': '{:.2f}%', 'mkt_val_local': '¥{:,.0f}', 'profit_cny': '¥{:+,.0f}'}
-        )
+        render_stock_tab('cn', df_cn_calc, YIELD_COLS, FMT_CN, MONEY_CN)
 
     # Tab 3: SG
     with tab3:
-        render_stock_tab('sg', st.session_state.sg_inputs, df_sg_calc,
-            ['name', 'price', 'change_pct', 'yield_now', 'action', 'qty', 'mkt_val_local', 'profit_cny'],
-            {'price': 'S${:.3f}', 'change_pct': '{:+.2f}%', 'yield_now': '{:.2f}%', 'mkt_val_local': 'S${:,.0f}', 'profit_cny': '¥{:+,.0f}'}
-        )
+        render_stock_tab('sg', df_sg_calc, YIELD_COLS, FMT_SG, MONEY_SG)
 
     # Tab 4: US
     with tab4:
-        with st.expander("✏️ 编辑持仓 (修改后按Enter)", expanded=False):
-            edited_us = st.data_editor(st.session_state.us_inputs, num_rows="dynamic", use_container_width=True, key="editor_us")
-            st.session_state.us_inputs = edited_us
-            
-        st.dataframe(
-            df_us_calc[['name', 'price', 'change_pct', 'total_return_pct', 'qty', 'mkt_val_local', 'profit_cny']].style.format({
-                'price': '${:.2f}', 'change_pct': '{:+.2f}%', 'total_return_pct': '{:+.2f}%',
-                'mkt_val_local': '${:,.0f}', 'profit_cny': '¥{:+,.0f}'
-            }).applymap(lambda v: 'color: green' if v > 0 else 'color: red', subset=['total_return_pct']),
-            use_container_width=True, hide_index=True
-        )
+        render_stock_tab('us', df_us_calc, GROWTH_COLS, FMT_US, MONEY_US)
 
 except Exception as e:
     st.error(f"⚠️ 发生错误: {e}")